@@ -0,0 +1,99 @@
+"""
+Thin client for ConverterService.py. Uses only the standard library, so it starts
+without importing openai, tiktoken or customtkinter.
+"""
+
+import os
+import sys
+import json
+import argparse
+import http.client
+
+class ConverterClient:
+
+    # Constants
+    DEFAULT_HOST = "127.0.0.1"
+    DEFAULT_PORT = 8765
+    TOKEN_DIR = os.path.join(os.path.expanduser("~"), ".gpt_file_converter")
+    TOKEN_HEADER = "X-Converter-Token"
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None, token=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = token
+
+    @staticmethod
+    def get_token_path(port):
+        # Written by the service on start, readable by the current user only
+        return os.path.join(ConverterClient.TOKEN_DIR, f"service_{port}.token")
+
+    def _get_headers(self):
+        if self.token is None:
+            with open(ConverterClient.get_token_path(self.port), "r", encoding="utf-8") as f:
+                self.token = f.read().strip()
+        return {"Content-Type": "application/json", self.TOKEN_HEADER: self.token}
+
+    def get_status(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("GET", "/status", headers=self._get_headers())
+            response = connection.getresponse()
+            if response.status != 200:
+                return {"error": f"The service rejected the request ({response.status} {response.reason})"}
+            return json.loads(response.read())
+        finally:
+            connection.close()
+
+    def convert(self, prompt_file, input_file, reduce_prompt_file=None, language="English", model="gpt-3.5-turbo", output_format=".txt", chunking_mode="Fixed"):
+        # Yields the service's events ({"event": "progress" | "queued" | "warning" | "error" | "done", ...}) as they arrive
+        job = {
+            "prompt_file": os.path.abspath(prompt_file),
+            "input_file": os.path.abspath(input_file),
+            "reduce_prompt_file": os.path.abspath(reduce_prompt_file) if reduce_prompt_file else None,
+            "language": language,
+            "model": model,
+            "output_format": output_format,
+            "chunking_mode": chunking_mode,
+        }
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("POST", "/jobs", body=json.dumps(job), headers=self._get_headers())
+            response = connection.getresponse()
+            if response.status != 200:
+                yield {"event": "error", "message": f"The service rejected the job ({response.status} {response.reason})"}
+                return
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a conversion job to a running ConverterService.")
+    parser.add_argument("prompt_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--reduce-prompt-file")
+    parser.add_argument("--language", default="English", choices=["English", "Korean"])
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--output-format", default=".txt", choices=[".txt", ".md", ".csv"])
+    parser.add_argument("--chunking-mode", default="Fixed", choices=["Fixed", "Content-defined"])
+    parser.add_argument("--host", default=ConverterClient.DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=ConverterClient.DEFAULT_PORT)
+    args = parser.parse_args()
+
+    client = ConverterClient(args.host, args.port)
+    succeeded = False
+    for event in client.convert(args.prompt_file, args.input_file, args.reduce_prompt_file, args.language, args.model, args.output_format, args.chunking_mode):
+        if event["event"] == "progress":
+            print(f"Finished {event['processed_chunks']} chunks out of {event['num_chunks']} chunks")
+        elif event["event"] == "queued":
+            print("Waiting for the running jobs with other settings to finish...")
+        elif event["event"] == "warning":
+            print(f"Warning: {event['message']}", file=sys.stderr)
+        elif event["event"] == "error":
+            print(f"Error: {event['message']}", file=sys.stderr)
+        elif event["event"] == "done":
+            succeeded = True
+            print(f"Saved to {event['output_path']}")
+    sys.exit(0 if succeeded else 1)
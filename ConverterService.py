@@ -0,0 +1,232 @@
+import os
+import hmac
+import json
+import time
+import secrets
+import inspect
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from GPTHandler import GPTHandler
+from FileHandler import FileHandler
+from ConverterClient import ConverterClient
+
+class JobObserver:
+    """Headless observer for FileHandler that streams job events as JSON lines."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.RLock()
+        self.num_chunks = 0
+        self.processed_chunks = 0
+        self.failed = False
+        self.disconnected = False
+
+    def send(self, event, **kwargs):
+        # Progress arrives from several worker threads
+        with self.lock:
+            if self.disconnected:
+                return
+            try:
+                self.stream.write((json.dumps({"event": event, **kwargs}) + "\n").encode("utf-8"))
+                self.stream.flush()
+            except OSError as e:
+                # The client went away or stopped reading (the socket has a write timeout);
+                # stop writing to it, the job still finishes and fills the cache
+                self.disconnected = True
+                print(f"{inspect.currentframe().f_code.co_name}: Could not send '{event}' to the client: {e}")
+
+    def update(self, event, **kwargs):
+        if event == "set_num_chunks":
+            self.num_chunks = kwargs.get("num_chunks")
+            self.send("progress", processed_chunks=0, num_chunks=self.num_chunks)
+        elif event == "set_processed_chunks":
+            # Callbacks run outside GPTHandler.lock, so they can arrive slightly out of order
+            processed_chunks = kwargs.get("processed_chunks")
+            with self.lock:
+                if processed_chunks > self.processed_chunks:
+                    self.processed_chunks = processed_chunks
+                    self.send("progress", processed_chunks=processed_chunks, num_chunks=self.num_chunks)
+        elif event == "show_error":
+            self.failed = True
+            self.send("error", message=kwargs.get("message"))
+        elif event == "show_warning":
+            # The output was saved; the job still succeeds
+            self.send("warning", message=kwargs.get("message"))
+        return None
+
+class ConverterService:
+    """Long-lived local service that keeps GPTHandler warm between conversions.
+
+    Encodings, the pooled transport and an in-memory response cache stay loaded,
+    so thin clients (see ConverterClient.py) skip the per-process startup. Jobs
+    run concurrently and share GPTHandler's workers. Model and language set
+    class-wide limits in GPTHandler, so a job with other settings waits until the
+    running jobs are done.
+    """
+
+    # Constants
+    DEFAULT_HOST = "127.0.0.1"
+    DEFAULT_PORT = 8765
+    MAX_CACHED_RESPONSES = 10000
+    WRITE_TIMEOUT = 30
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.jobs_changed = threading.Condition()
+        self.active_jobs = 0
+        self.active_settings = None
+        self.response_cache = {}
+        self.started = time.time()
+        self.completed_jobs = 0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.port = self.server.server_address[1]
+        names = ("127.0.0.1", "localhost", host)
+        self.allowed_hosts = {f"{name}:{self.port}" for name in names} | set(names)
+        self.token = self._write_token()
+
+    def _write_token(self):
+        # A fresh token per start, in a file only the current user can read. Web pages
+        # cannot read it, so they cannot submit jobs even though they can reach localhost.
+        token = secrets.token_urlsafe(32)
+        os.makedirs(ConverterClient.TOKEN_DIR, mode=0o700, exist_ok=True)
+        token_path = ConverterClient.get_token_path(self.port)
+        if os.path.exists(token_path):
+            os.remove(token_path)
+        fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(token)
+        return token
+
+    def is_authorized(self, headers, require_json=False):
+        # Browsers always send Origin on cross-origin requests; scripted clients never do
+        if headers.get("Origin") is not None:
+            return False
+        # Blocks DNS rebinding, where a web page reaches us under its own host name
+        if headers.get("Host") not in self.allowed_hosts:
+            return False
+        if require_json and (headers.get("Content-Type") or "").split(";")[0].strip() != "application/json":
+            return False
+        return hmac.compare_digest(headers.get(ConverterClient.TOKEN_HEADER) or "", self.token)
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Applied to the socket, so a client that stops reading cannot block a job forever
+            timeout = service.WRITE_TIMEOUT
+
+            def do_GET(self):
+                if self.path != "/status":
+                    self.send_error(404)
+                    return
+                if not service.is_authorized(self.headers):
+                    self.send_error(403)
+                    return
+                self._send_json(service.get_status())
+
+            def do_POST(self):
+                if self.path != "/jobs":
+                    self.send_error(404)
+                    return
+                if not service.is_authorized(self.headers, require_json=True):
+                    self.send_error(403)
+                    return
+                try:
+                    job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                except ValueError as e:
+                    self.send_error(400, f"Invalid job: {e}")
+                    return
+                # No Content-Length: events are streamed until the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                service.run_job(job, JobObserver(self.wfile))
+
+            def _send_json(self, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def serve(self):
+        # Open the connection pool before the first job arrives
+        GPTHandler.get_transport()
+        host, port = self.server.server_address[:2]
+        print(f"{inspect.currentframe().f_code.co_name}: Listening on http://{host}:{port}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(ConverterClient.get_token_path(self.port))
+
+    def get_status(self):
+        return {
+            "uptime": time.time() - self.started,
+            "completed_jobs": self.completed_jobs,
+            "cached_responses": len(self.response_cache),
+            "active_jobs": self.active_jobs,
+            "transport": GPTHandler.get_transport().get_stats(),
+        }
+
+    def run_job(self, job, observer):
+        settings = (job.get("model", "gpt-3.5-turbo"), job.get("language", "English"))
+        with self.jobs_changed:
+            queued = self.active_jobs and self.active_settings != settings
+        # Sent outside the condition, since a slow client can block the write
+        if queued:
+            observer.send("queued")
+        with self.jobs_changed:
+            self.jobs_changed.wait_for(lambda: not self.active_jobs or self.active_settings == settings)
+            # Keep the cache bounded; it only saves requests, never changes results.
+            # Cleared only while idle, so no running job loses its entries.
+            if not self.active_jobs and len(self.response_cache) > self.MAX_CACHED_RESPONSES:
+                self.response_cache.clear()
+            self.active_jobs += 1
+            self.active_settings = settings
+        try:
+            output_path = self._convert(job, observer)
+        except Exception as e:
+            observer.send("error", message=f"An error occurred while converting: {e}")
+            return
+        finally:
+            with self.jobs_changed:
+                self.active_jobs -= 1
+                self.jobs_changed.notify_all()
+        if output_path and not observer.failed:
+            with self.jobs_changed:
+                self.completed_jobs += 1
+            observer.send("done", output_path=output_path)
+
+    def _convert(self, job, observer):
+        file_handler = FileHandler()
+        file_handler.attach(observer)
+
+        # The service reads the files itself, exactly like the GUI does
+        with open(job["prompt_file"], "r", encoding="utf-8") as file:
+            file_handler.prompt_content = file.read()
+        with open(job["input_file"], "r", encoding="utf-8") as file:
+            file_handler.input_content = file.read()
+        if job.get("reduce_prompt_file"):
+            with open(job["reduce_prompt_file"], "r", encoding="utf-8") as file:
+                file_handler.reduce_prompt_content = file.read()
+        file_handler.input_base_name = os.path.splitext(os.path.basename(job["input_file"]))[0]
+        file_handler.input_path = os.path.dirname(os.path.abspath(job["input_file"]))
+
+        file_handler.response_cache = self.response_cache
+
+        output_format = job.get("output_format", ".txt")
+        file_handler.run_file_converter(job.get("language", "English"), job.get("model", "gpt-3.5-turbo"), output_format, job.get("chunking_mode", "Fixed"))
+        if observer.failed:
+            return None
+        return FileHandler._get_output_path(file_handler.input_base_name, file_handler.input_path, output_format)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the file converter as a local service.")
+    parser.add_argument("--host", default=ConverterService.DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=ConverterService.DEFAULT_PORT)
+    args = parser.parse_args()
+    ConverterService(args.host, args.port).serve()
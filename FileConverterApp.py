@@ -11,6 +11,8 @@ class FileConverterApp:
     FILE_TYPES = [("Text files", "*.txt")]
     DEFAULT_OUTPUT_FORMAT = ".txt"
     DEFAULT_LANGUAGE = "English"
+    DEFAULT_CHUNKING_MODE = "Fixed"
+    NO_REDUCE_PROMPT_TEXT = "No reduce prompt file selected"
 
     # Singleton
     _instance = None
@@ -35,6 +37,7 @@ class FileConverterApp:
         self.output_format = StringVar(value=self.DEFAULT_OUTPUT_FORMAT)
         self.file_language = StringVar(value=self.DEFAULT_LANGUAGE)
         self.gpt_model = StringVar(value="gpt-3.5-turbo")
+        self.chunking_mode = StringVar(value=self.DEFAULT_CHUNKING_MODE)
 
         # Set up the FileHandler
         self.file_handler = FileHandler()
@@ -56,16 +59,21 @@ class FileConverterApp:
     def init_ui_components(self, frame):
         self.set_default_bt, self.default_label = self._init_component(frame, "Set Default Content Directory", self.file_handler.set_default_dir, "No default directory set")
         self.open_prompt_bt, self.prompt_label = self._init_component(frame, "Open Prompt File", self.file_handler.open_prompt_file, "No prompt file selected")
+        self.open_reduce_prompt_bt, self.reduce_prompt_label = self._init_component(frame, "Open Reduce Prompt File (Optional)", self.file_handler.open_reduce_prompt_file, self.NO_REDUCE_PROMPT_TEXT)
+        self.clear_reduce_prompt_bt = customtkinter.CTkButton(frame, text="Clear Reduce Prompt", command=self.file_handler.clear_reduce_prompt)
+        self.clear_reduce_prompt_bt.pack()
 
         self.language_dropdown = OptionMenu(frame, self.file_language, "English", "Korean")
         self.language_dropdown.pack()
         self.select_model_dropdown = OptionMenu(frame, self.gpt_model, *self.file_handler.models)
         self.select_model_dropdown.pack()
+        self.chunking_mode_dropdown = OptionMenu(frame, self.chunking_mode, *self.file_handler.chunking_modes)
+        self.chunking_mode_dropdown.pack()
 
         self.open_content_bt, self.content_label = self._init_component(frame, "Open Content File", self.file_handler.open_content_file, "No content file selected") 
         
         self.run_bt, self.run_label = self._init_component(frame, "RUN", lambda: self.file_handler.run_file_converter(
-            self.file_language.get(), self.gpt_model.get(), self.output_format.get()), "Not replied yet")
+            self.file_language.get(), self.gpt_model.get(), self.output_format.get(), self.chunking_mode.get()), "Not replied yet")
         
         self.output_format_label = customtkinter.CTkLabel(frame, text="Select Output Format:")
         self.output_format_label.pack()
@@ -88,15 +96,19 @@ class FileConverterApp:
         update_mapping = {
             "request_directory": self._update_directory,
             "request_prompt_file": lambda **kwargs: self._update_file("Open Prompt File", **kwargs),
+            "request_reduce_prompt_file": lambda **kwargs: self._update_file("Open Reduce Prompt File", **kwargs),
             "request_content_file": lambda **kwargs: self._update_file("Open Content File", **kwargs),
             "update_default_label": lambda **kwargs: self._set_label_text(self.default_label, kwargs.get("default_dir")),
             "update_prompt_label": lambda **kwargs: self._set_label_text(self.prompt_label, kwargs.get("filepath")),
+            "update_reduce_prompt_label": lambda **kwargs: self._set_label_text(self.reduce_prompt_label, kwargs.get("filepath")),
+            "reset_reduce_prompt_label": lambda **kwargs: self._set_label_text(self.reduce_prompt_label, self.NO_REDUCE_PROMPT_TEXT),
             "update_content_label": lambda **kwargs: self._set_label_text(self.content_label, kwargs.get("filepath")),
             "update_run_label": lambda **kwargs: self._set_label_text(self.run_label, f"{kwargs.get('run_count')} requests completed"),
             "reset_labels": self._reset_labels,
             "set_num_chunks": lambda **kwargs: self._set_num_chunks(kwargs.get('num_chunks')),
             "set_processed_chunks": lambda **kwargs: self._set_processed_chunks(kwargs.get('processed_chunks')),
             "show_error": lambda **kwargs: self._show_error(kwargs.get("message")),
+            "show_warning": lambda **kwargs: self._show_warning(kwargs.get("message")),
             "one_thread_processing_complete": lambda **kwargs: self._set_label_text(self.run_label, f"{kwargs.get('run_count')} requests completed")
         }
         return update_mapping.get(event, lambda **kwargs: None)(**kwargs)
@@ -133,6 +145,9 @@ class FileConverterApp:
     def _show_error(self, message):
         messagebox.showerror("Error", message)
 
+    def _show_warning(self, message):
+        messagebox.showwarning("Warning", message)
+
     def _reset_labels(self, **kwargs):
         self.run_label.configure(text="Not replied yet")
 
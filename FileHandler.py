@@ -1,13 +1,23 @@
 import functools
 import os
+import json
 import inspect
 from GPTHandler import GPTHandler
 from Observable import Observable
+from Validators import CSVValidator
 from decorators import log_function_call
 
 class FileHandler(Observable):
 
     models = GPTHandler.models
+    chunking_modes = ["Fixed", "Content-defined"]
+
+    # constants
+    rolling_window = 32
+    rolling_base = 257
+    rolling_mod = (1 << 31) - 1
+    rolling_max_factor = 4
+    manifest_version = 1
 
     def __init__(self):
         
@@ -20,9 +30,13 @@ class FileHandler(Observable):
 
         # Set up fields related to content
         self.prompt_content = None
+        self.reduce_prompt_content = None
         self.input_content = None
         self.chunks_content = []
         self.chunk_chars = 0
+
+        # In-memory {chunk key: response} kept across runs (e.g. by the service mode)
+        self.response_cache = None
     
     @staticmethod
     def _clamp(x, min_val, max_val):
@@ -52,11 +66,125 @@ class FileHandler(Observable):
             start_idx = end_idx
 
         return chunks
-    
+
+    @log_function_call
+    @staticmethod
+    # Split the content where a rolling hash of the last {rolling_window} characters
+    # hits a target, so boundaries move with the text instead of with absolute offsets
+    def _split_content_by_hash(content, chunk_chars, max_tokens=None):
+        window = FileHandler.rolling_window
+        base = FileHandler.rolling_base
+        mod = FileHandler.rolling_mod
+        # Weight of the character leaving the window
+        drop = pow(base, window, mod)
+        # Anchors count from half a chunk, then one is expected every ~chunk_chars / 4 characters
+        min_chars = chunk_chars // 2
+        divisor = max(chunk_chars // 4, 1)
+        # Only for content where no anchor ever hits (e.g. long repeats); normal text never gets here
+        max_chars = chunk_chars * FileHandler.rolling_max_factor
+
+        chunks = []
+        content_len = len(content)
+        start_idx = 0
+        rolling = 0
+        anchored = False
+
+        for idx, char in enumerate(content):
+            rolling = (rolling * base + ord(char)) % mod
+            if idx >= window:
+                rolling = (rolling - ord(content[idx - window]) * drop) % mod
+
+            chunk_len = idx + 1 - start_idx
+            if chunk_len >= min_chars and rolling % divisor == 0:
+                anchored = True
+            # Cut at the first space or newline after the anchor
+            if anchored and char in [' ', '\n']:
+                end_idx = idx + 1
+            # No anchor found: fall back to the last space or newline like _split_content_by_estimate
+            elif chunk_len >= max_chars:
+                end_idx = max(content.rfind(' ', start_idx, idx + 1), content.rfind('\n', start_idx, idx + 1)) + 1
+                # The content is a single word that is longer than the block size
+                if end_idx <= start_idx:
+                    end_idx = idx + 1
+            else:
+                continue
+
+            chunks.append(content[start_idx:end_idx])
+            start_idx = end_idx
+            anchored = False
+
+        if start_idx < content_len:
+            chunks.append(content[start_idx:])
+
+        if max_tokens:
+            chunks = FileHandler._resplit_oversize_chunks(chunks, max_tokens)
+
+        return chunks
+
+    @staticmethod
+    # Split only the chunks over {max_tokens} into equal parts; the parts depend on that
+    # chunk alone, so an edit elsewhere never moves them
+    def _resplit_oversize_chunks(chunks, max_tokens):
+        resplit_chunks = []
+        for chunk in chunks:
+            token_count = GPTHandler.get_token_count(chunk)
+            if token_count <= max_tokens:
+                resplit_chunks.append(chunk)
+                continue
+            num_parts = -(-token_count // max_tokens)
+            parts = FileHandler._split_content_by_estimate(chunk, -(-len(chunk) // num_parts))
+            # Parts of equal length can still differ in tokens; add parts until every one fits
+            while num_parts < len(chunk) and any(GPTHandler.get_token_count(part) > max_tokens for part in parts):
+                num_parts += 1
+                parts = FileHandler._split_content_by_estimate(chunk, -(-len(chunk) // num_parts))
+            resplit_chunks.extend(parts)
+        return resplit_chunks
+
+    @staticmethod
+    def _get_output_path(base_name, path, format):
+        return os.path.join(path, f"GPT_{base_name}{format}")
+
+    @staticmethod
+    def _get_manifest_path(base_name, path):
+        return os.path.join(path, f"GPT_{base_name}.manifest.json")
+
+    @log_function_call
+    @staticmethod
+    # Load the chunk responses of the previous run as {chunk key: response}
+    def _load_manifest(base_name, path):
+        file_name = FileHandler._get_manifest_path(base_name, path)
+        if not os.path.exists(file_name):
+            return {}
+        try:
+            with open(file_name, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != FileHandler.manifest_version:
+                return {}
+            return {chunk["key"]: chunk["response"] for chunk in manifest["chunks"]}
+        except Exception as e:
+            print(f"{inspect.currentframe().f_code.co_name}: An error occurred while loading the manifest: {e}")
+            return {}
+
+    @log_function_call
+    @staticmethod
+    # Save only the chunks of this run so the manifest does not grow across runs
+    def _save_manifest(base_name, path, prompt_content, chunks_content, response_cache):
+        file_name = FileHandler._get_manifest_path(base_name, path)
+        chunks = []
+        for chunk in chunks_content:
+            key = GPTHandler.get_chunk_key(prompt_content, chunk)
+            if key in response_cache:
+                chunks.append({"key": key, "response": response_cache[key]})
+        try:
+            with open(file_name, 'w', encoding='utf-8') as f:
+                json.dump({"version": FileHandler.manifest_version, "chunks": chunks}, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"{inspect.currentframe().f_code.co_name}: An error occurred while saving the manifest: {e}")
+
     @log_function_call
     @staticmethod
     def _save_response(base_name, path, response, format):
-        file_name = os.path.join(path, f"GPT_{base_name}{format}")
+        file_name = FileHandler._get_output_path(base_name, path, format)
         try:
             with open(file_name, 'w', encoding='utf-8') as f:
                 f.write(response)
@@ -95,6 +223,31 @@ class FileHandler(Observable):
             except Exception as e:
                 self.notify("show_error", message=f"An error occurred while reading the file: {e}")
 
+    @log_function_call
+    # Open the (optional) reduce prompt file used to merge chunk responses
+    def open_reduce_prompt_file(self):
+        initial_directory = self.default_dir if self.default_dir else None
+        reduce_prompt_file = self.notify("request_reduce_prompt_file", initialdir=initial_directory)
+
+        if reduce_prompt_file:
+            try:
+                with open(reduce_prompt_file, "r", encoding="utf-8") as file:
+                    self.reduce_prompt_content = file.read()
+                self.notify("update_reduce_prompt_label", filepath=reduce_prompt_file)
+                self.notify("reset_labels")
+            except FileNotFoundError:
+                self._reset_reduce_prompt()
+                self.notify("show_error", message=f"File '{reduce_prompt_file}' not found.")
+            except Exception as e:
+                self._reset_reduce_prompt()
+                self.notify("show_error", message=f"An error occurred while reading the file: {e}")
+
+    @log_function_call
+    # Turn the reduce stage off again
+    def clear_reduce_prompt(self):
+        self._reset_reduce_prompt()
+        self.notify("reset_labels")
+
     @log_function_call
     # Open the content file
     def open_content_file(self):
@@ -119,7 +272,7 @@ class FileHandler(Observable):
 
     @log_function_call
     # Set the chunks to the request
-    def _set_chunks(self, language):
+    def _set_chunks(self, language, chunking_mode):
         # Check if the prompt and content files are selected
         if not self.input_content or not self.prompt_content:
             self.notify("show_error", message="Please ensure both the prompt and input files are selected.")
@@ -130,17 +283,24 @@ class FileHandler(Observable):
         
         # Split the content into chunks
         if self.chunk_chars > 0:
-            self._set_chunks_content()
-            print(f"language: {language}, chunk_chars: {self.chunk_chars}, chunks_content: {len(self.chunks_content)}")
+            self._set_chunks_content(chunking_mode)
+            print(f"language: {language}, chunking_mode: {chunking_mode}, chunk_chars: {self.chunk_chars}, chunks_content: {len(self.chunks_content)}")
     
     @log_function_call
     # Run the file converter
-    def run_file_converter(self, language, gpt_model, output_format):
+    def run_file_converter(self, language, gpt_model, output_format, chunking_mode="Fixed"):
+        # Make sure requests can be sent at all before splitting anything
+        try:
+            GPTHandler.get_transport()
+        except ValueError as e:
+            self.notify("show_error", message=str(e))
+            return
+
         # Set the maximum token according to the selected model
         GPTHandler.change_tokens(gpt_model)
 
         # Set the chunks to the request
-        self._set_chunks(language)
+        self._set_chunks(language, chunking_mode)
         
         # Check if the block size and chunks are set
         if not self.chunk_chars or not self.chunks_content:
@@ -150,11 +310,41 @@ class FileHandler(Observable):
         # Update the number of chunks
         self.notify("set_num_chunks", num_chunks=len(self.chunks_content))
 
-        accumulated_response = GPTHandler.start_threaded_get_response(self.prompt_content, self.chunks_content, lambda **kwargs: self.notify("set_processed_chunks", **kwargs))
+        # Content-defined chunks stay stable across edits, so only changed chunks are re-sent
+        response_cache = self.response_cache
+        if chunking_mode == "Content-defined":
+            manifest = FileHandler._load_manifest(self.input_base_name, self.input_path)
+            if response_cache is not None:
+                response_cache.update(manifest)
+            else:
+                response_cache = manifest
+
+        # Malformed CSV chunks are re-requested as soon as they arrive
+        validators = [CSVValidator()] if output_format == ".csv" else []
+
+        accumulated_response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response(self.prompt_content, self.chunks_content, lambda **kwargs: self.notify("set_processed_chunks", **kwargs), self.reduce_prompt_content, response_cache, validators)
+        if chunking_mode == "Content-defined":
+            FileHandler._save_manifest(self.input_base_name, self.input_path, self.prompt_content, self.chunks_content, response_cache)
+
+        # Never overwrite the previous output with a partial one; the responses that did
+        # arrive are cached, so running again only re-sends the failed chunks
+        if failed_chunks:
+            self.notify("show_error", message=f"{failed_chunks} of {len(self.chunks_content)} chunks failed, so the output was not saved. Please run again.")
+            return
+
         FileHandler._save_response(self.input_base_name, self.input_path, accumulated_response, output_format)
         self.notify("update_run_label", run_count=len(self.chunks_content))
 
+        # The responses are saved anyway, but the user should not have to find the bad ones in the file
+        if invalid_chunks:
+            details = ", ".join(f"{idx + 1} ({error})" for idx, error in invalid_chunks)
+            self.notify("show_warning", message=f"{len(invalid_chunks)} chunks were still invalid after {GPTHandler.validation_retries} retries: {details}")
+
     # Private methods
+    def _reset_reduce_prompt(self):
+        self.reduce_prompt_content = None
+        self.notify("reset_reduce_prompt_label")
+
     @log_function_call
     def _set_chunk_chars(self, language):
         chunk_chars = GPTHandler.calculate_chunk_chars(self.prompt_content, language)
@@ -165,8 +355,12 @@ class FileHandler(Observable):
             self.chunk_chars = chunk_chars
     
     @log_function_call
-    def _set_chunks_content(self):
-        chunks_content = FileHandler._split_content_by_estimate(self.input_content, self.chunk_chars)
+    def _set_chunks_content(self, chunking_mode):
+        if chunking_mode == "Content-defined":
+            max_tokens = GPTHandler.chunk_token_limit - GPTHandler.get_token_count(self.prompt_content)
+            chunks_content = FileHandler._split_content_by_hash(self.input_content, self.chunk_chars, max_tokens)
+        else:
+            chunks_content = FileHandler._split_content_by_estimate(self.input_content, self.chunk_chars)
         if not chunks_content:
             self.notify("show_error", message=f"An error occurred while splitting the content.")
             self.notify("reset_labels")
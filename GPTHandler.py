@@ -1,12 +1,11 @@
 import functools
-import os
-import openai
+import hashlib
 import tiktoken
 import threading
 import inspect
 from decorators import log_function_call
-
-openai.api_key = os.environ.get('OPENAI_API_KEY')
+from Transport import HTTPTransport
+from RateLimiter import SharedRateLimiter
 
 class GPTHandler:
 
@@ -15,9 +14,14 @@ class GPTHandler:
     lock = threading.Lock()
     encoding = tiktoken.get_encoding("cl100k_base")
     encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    processed_chunks = 0
+    workers = None
+    transport = None
+    rate_limiter = None
+    rate_limiter_loaded = False
 
     # constants
+    max_workers = 8
+    validation_retries = 2
     max_tokens_for_current_model = 2048
     chunk_token_limit = 2000
     safety_margin = 300
@@ -44,66 +48,295 @@ class GPTHandler:
             GPTHandler.chunk_token_limit = 4000
             GPTHandler.encoding = tiktoken.encoding_for_model(model)
 
+    @log_function_call
+    @staticmethod
+    def set_transport(transport):
+        # Swap the backend (e.g. FakeTransport for tests and benchmarks)
+        with GPTHandler.lock:
+            if GPTHandler.transport:
+                GPTHandler.transport.close()
+            GPTHandler.transport = transport
+
+    @staticmethod
+    def get_transport():
+        # Lazily create the pooled HTTP transport, sized to the worker count
+        with GPTHandler.lock:
+            if GPTHandler.transport is None:
+                GPTHandler.transport = HTTPTransport(pool_size=GPTHandler.max_workers)
+            return GPTHandler.transport
+
+    @staticmethod
+    def get_workers():
+        # One semaphore for the whole process, so concurrent runs share max_workers
+        # instead of each opening that many requests of its own
+        with GPTHandler.lock:
+            if GPTHandler.workers is None:
+                GPTHandler.workers = threading.BoundedSemaphore(GPTHandler.max_workers)
+            return GPTHandler.workers
+
+    @log_function_call
+    @staticmethod
+    def set_rate_limiter(rate_limiter):
+        # Share the RPM/TPM budget with other converter processes (None disables it)
+        with GPTHandler.lock:
+            GPTHandler.rate_limiter = rate_limiter
+            GPTHandler.rate_limiter_loaded = True
+
+    @staticmethod
+    def get_rate_limiter():
+        # Lazily read the limits from the environment, so bad values never break the import
+        with GPTHandler.lock:
+            if not GPTHandler.rate_limiter_loaded:
+                GPTHandler.rate_limiter = SharedRateLimiter.from_env()
+                GPTHandler.rate_limiter_loaded = True
+            return GPTHandler.rate_limiter
+
     @log_function_call
     @staticmethod
     def _get_response_from_chatgpt(prompt, content):
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        rate_limiter = GPTHandler.get_rate_limiter()
+        if rate_limiter:
+            # The response is not known yet, so assume it is about as long as the content
+            rate_limiter.acquire(GPTHandler.get_token_count(prompt) + 2 * GPTHandler.get_token_count(content))
+        return GPTHandler.get_transport().complete(
+            "gpt-3.5-turbo",
+            [
                 {"role": "system", "content": prompt},
                 {"role": "assistant", "content": "The input file is the content of the user (role)"},
                 {"role": "user", "content": content},
             ]
         ) # TODO: Add a feature that allows the user to select the model
-        return response.choices[0].message["content"].strip()
+
+    @staticmethod
+    def _retry_until_valid(prompt, chunk_index, chunk, response, validators):
+        # Re-request a malformed response right away, within the retry budget; returns the
+        # last response and the reason it is still invalid (None when it passed)
+        for attempt in range(GPTHandler.validation_retries):
+            error = GPTHandler.validate_response(chunk, response, validators)
+            if not error:
+                return response, None
+            print(f"{chunk_index + 1} rejected ({error}), retry {attempt + 1}/{GPTHandler.validation_retries}")
+            response = GPTHandler._get_response_from_chatgpt(prompt, chunk)
+        error = GPTHandler.validate_response(chunk, response, validators)
+        if error:
+            print(f"{chunk_index + 1} still invalid after {GPTHandler.validation_retries} retries ({error}), keeping the last response")
+        return response, error
 
     @log_function_call
     @staticmethod
-    def _threaded_get_response(prompt_content, num_chunks, chunk_index, chunk, response_list, callback=None):
+    def _threaded_get_response(prompt_content, num_chunks, chunk_index, chunk, response_list, workers, progress, callback=None, validators=None, invalid_chunks=None):
         try:
             prompt = prompt_content
-            response = GPTHandler._get_response_from_chatgpt(prompt, chunk)
+            # Never run more requests than there are pooled connections
+            with workers:
+                response = GPTHandler._get_response_from_chatgpt(prompt, chunk)
+                # Validators that still have to learn from the whole run are applied afterwards
+                response, error = GPTHandler._retry_until_valid(prompt, chunk_index, chunk, response, [validator for validator in validators or [] if validator.ready])
             with GPTHandler.lock:
+                if error and invalid_chunks is not None:
+                    invalid_chunks.append((chunk_index, error))
                 response_list.append((chunk_index, response))
-                GPTHandler.processed_chunks += 1
-                print(f"{chunk_index + 1} received: {GPTHandler.processed_chunks}/{num_chunks} completed ({GPTHandler.get_token_count(response)} tokens)")
-                if callback:
-                    callback(processed_chunks=GPTHandler.processed_chunks)
+                progress["processed_chunks"] += 1
+                processed_chunks = progress["processed_chunks"]
+                print(f"{chunk_index + 1} received: {processed_chunks}/{num_chunks} completed ({GPTHandler.get_token_count(response)} tokens)")
+            # Outside the lock, so a slow observer never stalls the other workers
+            if callback:
+                callback(processed_chunks=processed_chunks)
         except Exception as e:
             print(f"{inspect.currentframe().f_code.co_name}: An error occurred in thread {chunk_index}: {e}")
 
     @log_function_call
     @staticmethod
-    def start_threaded_get_response(prompt_content, chunks_content, callback=None):
+    def _threaded_revalidate(prompt_content, chunk_index, chunk, response, revalidated, workers, validators):
+        try:
+            with workers:
+                response, error = GPTHandler._retry_until_valid(prompt_content, chunk_index, chunk, response, validators)
+            with GPTHandler.lock:
+                revalidated[chunk_index] = (response, error)
+        except Exception as e:
+            print(f"{inspect.currentframe().f_code.co_name}: An error occurred in thread {chunk_index}: {e}")
 
-        if not prompt_content or not chunks_content:
-            print(f"{inspect.currentframe().f_code.co_name}: Please ensure both the prompt and input files are selected.")
-            return
+    @log_function_call
+    @staticmethod
+    def _revalidate_responses(prompt_content, chunks_content, response_list, workers, validators, invalid_chunks):
+        # Let validators learn from every response of the run (e.g. the majority CSV column
+        # count), then re-request only the responses that fail against what was learned
+        responses = [response for _, response in response_list]
+        for validator in validators:
+            validator.learn(responses)
 
-        # Calculate the max characters left after adding the prompt
-        # Estimate max character count based on remaining tokens
-        accumulated_response = ""
+        already_invalid = set(idx for idx, _ in invalid_chunks) if invalid_chunks is not None else set()
+        threads = []
+        revalidated = {}
+        for idx, response in response_list:
+            if idx in already_invalid or not GPTHandler.validate_response(chunks_content[idx], response, validators):
+                continue
+            thread = threading.Thread(target=GPTHandler._threaded_revalidate, args=(prompt_content, idx, chunks_content[idx], response, revalidated, workers, validators), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        for position, (idx, response) in enumerate(response_list):
+            if idx in revalidated:
+                response, error = revalidated[idx]
+                response_list[position] = (idx, response)
+                if error and invalid_chunks is not None:
+                    invalid_chunks.append((idx, error))
+
+    @log_function_call
+    @staticmethod
+    def _run_threaded_requests(prompt_content, chunks_content, callback=None, response_cache=None, validators=None, invalid_chunks=None):
         response_list = []  # List to store tuples of (index, response)
         threads = []
         num_chunks = len(chunks_content)
+        workers = GPTHandler.get_workers()
+        # Counted per call, so runs that share the workers never mix up their progress
+        progress = {"processed_chunks": 0}
+        chunk_keys = [GPTHandler.get_chunk_key(prompt_content, chunk) for chunk in chunks_content] if response_cache is not None else []
 
         for idx, chunk in enumerate(chunks_content):
-            response_thread = threading.Thread(target=GPTHandler._threaded_get_response, args=(prompt_content, num_chunks, idx, chunk, response_list, callback), daemon=True)
+            # Reuse the previous run's response when this exact chunk was already sent and is still valid
+            if response_cache is not None and chunk_keys[idx] in response_cache and not GPTHandler.validate_response(chunk, response_cache[chunk_keys[idx]], validators):
+                with GPTHandler.lock:
+                    response_list.append((idx, response_cache[chunk_keys[idx]]))
+                    progress["processed_chunks"] += 1
+                continue
+            response_thread = threading.Thread(target=GPTHandler._threaded_get_response, args=(prompt_content, num_chunks, idx, chunk, response_list, workers, progress, callback, validators, invalid_chunks), daemon=True)
             response_thread.start()
             threads.append(response_thread)
 
+        if callback and progress["processed_chunks"]:
+            callback(processed_chunks=progress["processed_chunks"])
+
         # Wait for all threads to finish
         for thread in threads:
             thread.join()
 
-        # Save the accumulated response to one file
-        # Sort responses by their index and accumulate them in the correct order
+        if any(not validator.ready for validator in validators or []):
+            GPTHandler._revalidate_responses(prompt_content, chunks_content, response_list, workers, validators, invalid_chunks)
+
+        print(f"{inspect.currentframe().f_code.co_name}: {num_chunks - len(threads)} reused, {len(threads)} sent, transport stats: {GPTHandler.get_transport().get_stats()}")
+
+        if response_cache is not None:
+            for idx, response in response_list:
+                response_cache[chunk_keys[idx]] = response
+
+        # Sort responses by their index so they stay in the original order
         response_list.sort(key=lambda x: x[0])
+        return response_list
+
+    @staticmethod
+    def validate_response(chunk, response, validators):
+        # Returns the first failure reason, or None if every validator accepts the response
+        for validator in validators or []:
+            error = validator.validate(chunk, response)
+            if error:
+                return error
+        return None
+
+    @staticmethod
+    def _join_responses(response_list):
+        accumulated_response = ""
         for idx, response in response_list:
             accumulated_response += f"\n{idx + 1}.\n" + response + "\n"
-        
         return accumulated_response
-    
+
+    @log_function_call
+    @staticmethod
+    def start_threaded_get_response(prompt_content, chunks_content, callback=None, reduce_prompt=None, response_cache=None, validators=None):
+
+        # Returns the accumulated response, the (index, reason) of chunks that stayed invalid
+        # and the number of chunks that failed and are missing from the response
+        if not prompt_content or not chunks_content:
+            print(f"{inspect.currentframe().f_code.co_name}: Please ensure both the prompt and input files are selected.")
+            return None, [], len(chunks_content or [])
+
+        invalid_chunks = []
+        response_list = GPTHandler._run_threaded_requests(prompt_content, chunks_content, callback, response_cache, validators, invalid_chunks)
+        invalid_chunks.sort()
+        failed_chunks = len(chunks_content) - len(response_list)
+        if failed_chunks:
+            print(f"{inspect.currentframe().f_code.co_name}: {failed_chunks} of {len(chunks_content)} chunks failed.")
+
+        # Optionally merge the chunk responses into one with the reduce prompt
+        if reduce_prompt:
+            if failed_chunks:
+                return None, invalid_chunks, failed_chunks
+            return GPTHandler.start_threaded_reduce(reduce_prompt, [response for _, response in response_list]), invalid_chunks, failed_chunks
+
+        # Save the accumulated response to one file
+        return GPTHandler._join_responses(response_list), invalid_chunks, failed_chunks
+
+    @log_function_call
+    @staticmethod
+    def _group_for_reduce(reduce_prompt, responses):
+        # Greedily pack neighbouring responses so each merge request fits in chunk_token_limit
+        max_tokens_for_content = GPTHandler.chunk_token_limit - GPTHandler.get_token_count(reduce_prompt)
+        groups = []
+        group, group_tokens = [], 0
+        for response in responses:
+            # The numbering added by _join_responses costs a few tokens per response
+            tokens = GPTHandler.get_token_count(response) + 4
+            if group and group_tokens + tokens > max_tokens_for_content:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(response)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    @log_function_call
+    @staticmethod
+    def start_threaded_reduce(reduce_prompt, responses):
+
+        if not reduce_prompt or not responses:
+            print(f"{inspect.currentframe().f_code.co_name}: Please ensure both the reduce prompt and responses are given.")
+            return
+
+        if GPTHandler.get_token_count(reduce_prompt) >= GPTHandler.chunk_token_limit:
+            print(f"{inspect.currentframe().f_code.co_name}: The reduce prompt is too long.")
+            return GPTHandler._join_responses(enumerate(responses))
+
+        # A single response still goes through the reduce prompt once, so the output
+        # has the same form whether the document had one chunk or many
+        if len(responses) == 1:
+            merged = GPTHandler._run_threaded_requests(reduce_prompt, [GPTHandler._join_responses(enumerate(responses))])
+            if not merged:
+                print(f"{inspect.currentframe().f_code.co_name}: The reduce request failed.")
+                return GPTHandler._join_responses(enumerate(responses))
+            return merged[0][1]
+
+        # Merge in a tree: every level's groups are sent in parallel until one response is left
+        level = 0
+        while len(responses) > 1:
+            groups = GPTHandler._group_for_reduce(reduce_prompt, responses)
+            if len(groups) == len(responses):
+                print(f"{inspect.currentframe().f_code.co_name}: Responses are too long to merge further (level {level}).")
+                return GPTHandler._join_responses(enumerate(responses))
+
+            # Groups of one are passed up unchanged; only real merges cost a request
+            merges = [(idx, group) for idx, group in enumerate(groups) if len(group) > 1]
+            merged = GPTHandler._run_threaded_requests(reduce_prompt, [GPTHandler._join_responses(enumerate(group)) for _, group in merges])
+            if len(merged) != len(merges):
+                print(f"{inspect.currentframe().f_code.co_name}: {len(merges) - len(merged)} merges failed at level {level}.")
+                return GPTHandler._join_responses(enumerate(responses))
+
+            next_responses = [group[0] for group in groups]
+            for (merge_idx, response) in merged:
+                next_responses[merges[merge_idx][0]] = response
+            print(f"{inspect.currentframe().f_code.co_name}: level {level}: {len(responses)} -> {len(next_responses)} responses")
+            responses = next_responses
+            level += 1
+
+        return responses[0]
+
+    @staticmethod
+    def get_chunk_key(prompt_content, chunk):
+        # Identifies a request by what is sent, so unchanged chunks can be matched across runs
+        return hashlib.sha256(f"{prompt_content}\0{chunk}".encode("utf-8")).hexdigest()
+
     @log_function_call
     @staticmethod 
     def get_token_count(content):
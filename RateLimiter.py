@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+class SharedRateLimiter:
+    """Token bucket for RPM and TPM shared by every converter process on this host.
+
+    The bucket lives in a small JSON file in the temp directory, one per API key,
+    and every read-modify-write happens under an exclusive file lock. Each process
+    therefore draws from the same budget instead of assuming it owns the quota.
+    """
+
+    # constants
+    poll_interval = 1
+
+    def __init__(self, rpm, tpm, api_key=None, state_dir=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.lock = threading.Lock()
+
+        api_key = api_key or os.environ.get('OPENAI_API_KEY') or ""
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        base_path = os.path.join(state_dir or tempfile.gettempdir(), f"gpt_file_converter_{key_hash}")
+        self.state_path = base_path + ".json"
+        self.lock_path = base_path + ".lock"
+
+    @staticmethod
+    def from_env():
+        # Enabled only when the limits are configured, like OPENAI_API_KEY
+        rpm = os.environ.get('OPENAI_RPM_LIMIT')
+        tpm = os.environ.get('OPENAI_TPM_LIMIT')
+        if not rpm or not tpm:
+            return None
+        try:
+            rpm, tpm = int(rpm), int(tpm)
+        except ValueError:
+            print(f"{inspect.currentframe().f_code.co_name}: OPENAI_RPM_LIMIT and OPENAI_TPM_LIMIT must be integers ({rpm!r}, {tpm!r}), rate limiting is disabled.")
+            return None
+        if rpm <= 0 or tpm <= 0:
+            print(f"{inspect.currentframe().f_code.co_name}: OPENAI_RPM_LIMIT and OPENAI_TPM_LIMIT must be positive ({rpm}, {tpm}), rate limiting is disabled.")
+            return None
+        return SharedRateLimiter(rpm, tpm)
+
+    def acquire(self, tokens):
+        # A single request larger than the whole TPM budget could never pass otherwise
+        tokens = min(tokens, self.tpm)
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, self.poll_interval))
+
+    def _try_acquire(self, tokens):
+        # Returns 0 when the budget was taken, otherwise the seconds to wait
+        with self.lock, open(self.lock_path, "a+") as lock_file:
+            self._lock_file(lock_file)
+            try:
+                state = self._read_state()
+                now = time.time()
+                elapsed = max(now - state["updated"], 0)
+                requests = min(self.rpm, state["requests"] + elapsed * self.rpm / 60)
+                available_tokens = min(self.tpm, state["tokens"] + elapsed * self.tpm / 60)
+
+                if requests >= 1 and available_tokens >= tokens:
+                    self._write_state({"requests": requests - 1, "tokens": available_tokens - tokens, "updated": now})
+                    return 0
+
+                self._write_state({"requests": requests, "tokens": available_tokens, "updated": now})
+                wait_requests = (1 - requests) * 60 / self.rpm if requests < 1 else 0
+                wait_tokens = (tokens - available_tokens) * 60 / self.tpm if available_tokens < tokens else 0
+                return max(wait_requests, wait_tokens)
+            finally:
+                self._unlock_file(lock_file)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"{inspect.currentframe().f_code.co_name}: Resetting the rate limit state: {e}")
+        # Start with a full bucket
+        return {"requests": self.rpm, "tokens": self.tpm, "updated": time.time()}
+
+    def _write_state(self, state):
+        # Write then rename so a crashed process never leaves a half-written file
+        temp_path = self.state_path + f".{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    @staticmethod
+    def _lock_file(lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+
+    @staticmethod
+    def _unlock_file(lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,107 @@
+import os
+import time
+import inspect
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+class Transport:
+    """Base class for sending chat completion requests.
+
+    Subclasses implement `complete` and return the content of the first choice.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def complete(self, model, messages):
+        raise NotImplementedError
+
+    def get_stats(self):
+        with self.lock:
+            return {"requests": self.num_requests, "errors": self.num_errors}
+
+    def close(self):
+        pass
+
+    def _count_request(self, failed=False):
+        with self.lock:
+            self.num_requests += 1
+            if failed:
+                self.num_errors += 1
+
+class HTTPTransport(Transport):
+    """Sends requests over a pooled keep-alive session to an OpenAI-compatible endpoint."""
+
+    # constants
+    DEFAULT_API_BASE = "https://api.openai.com/v1"
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_READ_TIMEOUT = 600
+
+    def __init__(self, pool_size, api_base=None, api_key=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        super().__init__()
+        self.api_base = (api_base or os.environ.get('OPENAI_API_BASE') or self.DEFAULT_API_BASE).rstrip("/")
+        self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        # Fail here instead of sending 'Bearer None' and getting a 401 for every chunk
+        if not self.api_key:
+            raise ValueError("No OpenAI API key found. Please set OPENAI_API_KEY.")
+        self.timeout = (connect_timeout, read_timeout)
+
+        # One pool per host, sized so every worker can hold its own connection open
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"Authorization": f"Bearer {self.api_key}"})
+
+    def complete(self, model, messages):
+        try:
+            response = self.session.post(f"{self.api_base}/chat/completions", json={"model": model, "messages": messages}, timeout=self.timeout)
+            response.raise_for_status()
+            content = response.json()["choices"][0]["message"]["content"]
+        except Exception:
+            self._count_request(failed=True)
+            raise
+        self._count_request()
+        return content.strip()
+
+    def get_stats(self):
+        stats = super().get_stats()
+        pools = self.adapter.poolmanager.pools
+        new_connections = sum(pools[key].num_connections for key in pools.keys())
+        stats["new_connections"] = new_connections
+        stats["reused_connections"] = max(stats["requests"] - new_connections, 0)
+        return stats
+
+    def close(self):
+        self.session.close()
+
+class FakeTransport(Transport):
+    """Local backend for tests and benchmarks; never touches the network.
+
+    `responder` receives the messages and returns the response text. By default
+    the user content is echoed back. `latency` (seconds) simulates round-trip time.
+    """
+
+    def __init__(self, responder=None, latency=0):
+        super().__init__()
+        self.responder = responder if responder else FakeTransport._echo
+        self.latency = latency
+
+    @staticmethod
+    def _echo(messages):
+        return messages[-1]["content"]
+
+    def complete(self, model, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            content = self.responder(messages)
+        except Exception as e:
+            self._count_request(failed=True)
+            print(f"{inspect.currentframe().f_code.co_name}: The fake responder raised an error: {e}")
+            raise
+        self._count_request()
+        return content.strip()
@@ -0,0 +1,99 @@
+import io
+import re
+import csv
+import json
+from collections import Counter
+
+class Validator:
+    """Checks one chunk response as it arrives.
+
+    `validate` returns None when the response is fine, otherwise a short reason.
+    A validator that is not `ready` still needs to see the whole run: it is only
+    applied after `learn` has been called with every response.
+    """
+
+    ready = True
+
+    def learn(self, responses):
+        pass
+
+    def validate(self, chunk, response):
+        raise NotImplementedError
+
+class CSVValidator(Validator):
+    # Without `columns`, the column count is the majority over the run's responses
+    def __init__(self, columns=None, delimiter=","):
+        self.columns = columns
+        self.delimiter = delimiter
+
+    @property
+    def ready(self):
+        return self.columns is not None
+
+    def learn(self, responses):
+        if self.columns is not None:
+            return
+        counts = Counter()
+        for response in responses:
+            rows = self._parse(response)
+            # Only responses that agree with themselves get a vote
+            if rows and all(len(row) == len(rows[0]) for row in rows):
+                counts[len(rows[0])] += 1
+        if counts:
+            self.columns = counts.most_common(1)[0][0]
+
+    def validate(self, chunk, response):
+        try:
+            rows = self._parse(response, strict=True)
+        except csv.Error as e:
+            return f"invalid CSV: {e}"
+        if not rows:
+            return "empty CSV"
+        # Before learning, a response can only be checked against its own first row
+        columns = self.columns if self.columns else len(rows[0])
+        for line, row in enumerate(rows):
+            if len(row) != columns:
+                return f"row {line + 1} has {len(row)} columns instead of {columns}"
+        return None
+
+    def _parse(self, response, strict=False):
+        try:
+            return [row for row in csv.reader(io.StringIO(response), delimiter=self.delimiter) if row]
+        except csv.Error:
+            if strict:
+                raise
+            return []
+
+class JSONValidator(Validator):
+    def validate(self, chunk, response):
+        try:
+            json.loads(response)
+        except ValueError as e:
+            return f"invalid JSON: {e}"
+        return None
+
+class RegexValidator(Validator):
+    # The whole response has to match the pattern
+    def __init__(self, pattern, flags=re.DOTALL):
+        self.pattern = re.compile(pattern, flags)
+
+    def validate(self, chunk, response):
+        if not self.pattern.fullmatch(response):
+            return f"does not match {self.pattern.pattern!r}"
+        return None
+
+class LengthRatioValidator(Validator):
+    # Catches truncated (too short) or runaway (too long) responses relative to the chunk
+    def __init__(self, min_ratio=0.0, max_ratio=None):
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+
+    def validate(self, chunk, response):
+        if not chunk:
+            return None
+        ratio = len(response) / len(chunk)
+        if ratio < self.min_ratio:
+            return f"length ratio {ratio:.2f} is below {self.min_ratio}"
+        if self.max_ratio is not None and ratio > self.max_ratio:
+            return f"length ratio {ratio:.2f} is above {self.max_ratio}"
+        return None
@@ -0,0 +1,73 @@
+import random
+from FileHandler import FileHandler
+from GPTHandler import GPTHandler
+
+def make_text(seed, length):
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < length:
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 10)))
+        if rng.random() < 0.02:
+            word += ".\n"
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+def insert_paragraph(text, seed):
+    rng = random.Random(1000 + seed)
+    paragraph = " ".join("".join(rng.choice("abcdefghij") for _ in range(rng.randint(2, 9))) for _ in range(60))[:380] + "\n"
+    position = text.find(" ", rng.randint(0, 3000)) + 1
+    return text[:position] + paragraph + text[position:]
+
+def test_split_content_by_hash_keeps_all_content():
+    text = make_text(0, 30000)
+    chunks = FileHandler._split_content_by_hash(text, 1000)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 1000 * FileHandler.rolling_max_factor for chunk in chunks)
+
+def test_split_content_by_hash_chunk_size_close_to_chunk_chars():
+    text = make_text(1, 60000)
+    chunks = FileHandler._split_content_by_hash(text, 1000)
+    average = len(text) / len(chunks)
+    assert 600 <= average <= 1300
+
+def test_split_content_by_hash_edit_only_changes_nearby_chunks():
+    # Regression: a paragraph inserted near the top must not shift every later boundary
+    changed = []
+    for seed in range(5):
+        text = make_text(seed, 30000)
+        before = FileHandler._split_content_by_hash(text, 1000)
+        after = FileHandler._split_content_by_hash(insert_paragraph(text, seed), 1000)
+        changed.append(len(set(after) - set(before)))
+    assert max(changed) <= 4
+    assert sum(changed) / len(changed) <= 2.5
+
+def test_split_content_by_hash_resplits_only_oversize_chunks():
+    text = make_text(2, 30000)
+    max_tokens = 100
+    unlimited = FileHandler._split_content_by_hash(text, 1000)
+    chunks = FileHandler._split_content_by_hash(text, 1000, max_tokens)
+    assert "".join(chunks) == text
+    assert all(GPTHandler.get_token_count(chunk) <= max_tokens for chunk in chunks)
+    # Chunks that already fit are left exactly as they were
+    fitting = [chunk for chunk in unlimited if GPTHandler.get_token_count(chunk) <= max_tokens]
+    assert set(fitting) <= set(chunks)
+
+def test_split_content_by_hash_without_anchor_falls_back_to_whitespace():
+    text = "abc " * 5000
+    chunks = FileHandler._split_content_by_hash(text, 100)
+    assert "".join(chunks) == text
+    assert all(chunk.endswith(" ") for chunk in chunks)
+
+def test_manifest_keeps_only_the_current_chunks(tmp_path):
+    response_cache = {GPTHandler.get_chunk_key("prompt", chunk): chunk.upper() for chunk in ["a", "b", "old"]}
+    FileHandler._save_manifest("input", str(tmp_path), "prompt", ["a", "b"], response_cache)
+
+    assert FileHandler._load_manifest("input", str(tmp_path)) == {GPTHandler.get_chunk_key("prompt", chunk): chunk.upper() for chunk in ["a", "b"]}
+
+def test_manifest_from_another_version_is_ignored(tmp_path):
+    with open(FileHandler._get_manifest_path("input", str(tmp_path)), "w", encoding="utf-8") as f:
+        f.write('{"version": 0, "chunks": [{"key": "k", "response": "r"}]}')
+
+    assert FileHandler._load_manifest("input", str(tmp_path)) == {}
@@ -0,0 +1,117 @@
+import pytest
+from collections import Counter
+from GPTHandler import GPTHandler
+from Transport import FakeTransport
+from Validators import CSVValidator, JSONValidator
+
+@pytest.fixture
+def use_transport(monkeypatch):
+    # Install a FakeTransport for one test and keep the real one out of it
+    monkeypatch.setattr(GPTHandler, "transport", None)
+    # Recreated on first use, so a patched max_workers takes effect
+    monkeypatch.setattr(GPTHandler, "workers", None)
+    monkeypatch.setattr(GPTHandler, "rate_limiter", None)
+    monkeypatch.setattr(GPTHandler, "rate_limiter_loaded", True)
+
+    def install(transport):
+        GPTHandler.transport = transport
+        return transport
+    return install
+
+def test_csv_majority_column_count_rejects_only_the_bad_chunk(use_transport, monkeypatch):
+    # The malformed chunk arrives first; it must not decide the column count
+    monkeypatch.setattr(GPTHandler, "max_workers", 1)
+    transport = use_transport(FakeTransport(responder=lambda messages: "a,b\n1,2" if messages[-1]["content"] == "c0" else "a,b,c\n1,2,3"))
+    chunks = [f"c{idx}" for idx in range(6)]
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", chunks, validators=[CSVValidator()])
+
+    assert [idx for idx, _ in invalid_chunks] == [0]
+    assert failed_chunks == 0
+    assert transport.get_stats()["requests"] == len(chunks) + GPTHandler.validation_retries
+
+def test_responses_keep_the_chunk_order(use_transport):
+    use_transport(FakeTransport())
+    chunks = [f"chunk {idx}" for idx in range(20)]
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", chunks)
+
+    assert response == "".join(f"\n{idx + 1}.\nchunk {idx}\n" for idx in range(20))
+    assert (invalid_chunks, failed_chunks) == ([], 0)
+
+def test_failed_chunk_is_counted_and_skips_the_reduce(use_transport):
+    def responder(messages):
+        if messages[-1]["content"] == "c3":
+            raise RuntimeError("connection reset")
+        return messages[-1]["content"]
+    transport = use_transport(FakeTransport(responder=responder))
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", [f"c{idx}" for idx in range(5)], reduce_prompt="reduce")
+
+    assert response is None
+    assert failed_chunks == 1
+    assert transport.get_stats()["requests"] == 5
+
+def test_reduce_merges_in_a_tree(use_transport, monkeypatch):
+    merges = []
+    def responder(messages):
+        merges.append(messages[-1]["content"])
+        return "summary"
+    use_transport(FakeTransport(responder=responder))
+    responses = [" ".join(["word"] * 20) for _ in range(8)]
+    # Exactly two responses fit in one merge request, so eight responses take 4 + 1 merges
+    response_tokens = GPTHandler.get_token_count(responses[0]) + 4
+    monkeypatch.setattr(GPTHandler, "chunk_token_limit", GPTHandler.get_token_count("reduce") + 2 * response_tokens + 1)
+
+    assert GPTHandler.start_threaded_reduce("reduce", responses) == "summary"
+    assert len(merges) == 5
+    assert all(merge.count("\n1.\n") == 1 and "\n2.\n" in merge for merge in merges[:4])
+
+def test_reduce_runs_once_for_a_single_response(use_transport):
+    transport = use_transport(FakeTransport(responder=lambda messages: messages[0]["content"] + ": " + messages[-1]["content"]))
+
+    assert GPTHandler.start_threaded_reduce("reduce", ["only"]) == "reduce: \n1.\nonly"
+    assert transport.get_stats()["requests"] == 1
+
+def test_invalid_response_is_retried_until_valid(use_transport):
+    attempts = Counter()
+    def responder(messages):
+        attempts[messages[-1]["content"]] += 1
+        return '{"ok": true}' if attempts[messages[-1]["content"]] > 1 else "not json"
+    use_transport(FakeTransport(responder=responder))
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", ["a", "b"], validators=[JSONValidator()])
+
+    assert invalid_chunks == []
+    assert attempts == {"a": 2, "b": 2}
+    assert response.count('{"ok": true}') == 2
+
+def test_still_invalid_response_is_kept_and_reported(use_transport):
+    transport = use_transport(FakeTransport(responder=lambda messages: "not json"))
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", ["a"], validators=[JSONValidator()])
+
+    assert [idx for idx, _ in invalid_chunks] == [0]
+    assert failed_chunks == 0
+    assert "not json" in response
+    assert transport.get_stats()["requests"] == 1 + GPTHandler.validation_retries
+
+def test_response_cache_skips_unchanged_chunks(use_transport):
+    transport = use_transport(FakeTransport())
+    response_cache = {}
+
+    first = GPTHandler.start_threaded_get_response("prompt", ["a", "b", "c"], response_cache=response_cache)[0]
+    second = GPTHandler.start_threaded_get_response("prompt", ["a", "changed", "c"], response_cache=response_cache)[0]
+
+    assert transport.get_stats()["requests"] == 4
+    assert first.replace("\nb\n", "\nchanged\n") == second
+    assert GPTHandler.get_chunk_key("prompt", "changed") in response_cache
+
+def test_cached_response_failing_validation_is_sent_again(use_transport):
+    transport = use_transport(FakeTransport(responder=lambda messages: '{"ok": true}'))
+    response_cache = {GPTHandler.get_chunk_key("prompt", "a"): "not json"}
+
+    response, invalid_chunks, failed_chunks = GPTHandler.start_threaded_get_response("prompt", ["a"], response_cache=response_cache, validators=[JSONValidator()])
+
+    assert transport.get_stats()["requests"] == 1
+    assert response_cache[GPTHandler.get_chunk_key("prompt", "a")] == '{"ok": true}'
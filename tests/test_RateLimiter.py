@@ -0,0 +1,47 @@
+import pytest
+from RateLimiter import SharedRateLimiter
+
+def test_full_bucket_allows_a_burst_then_waits(tmp_path):
+    rate_limiter = SharedRateLimiter(rpm=2, tpm=1000, api_key="key", state_dir=tmp_path)
+
+    assert rate_limiter._try_acquire(10) == 0
+    assert rate_limiter._try_acquire(10) == 0
+    # One request refills every 30 seconds at 2 RPM
+    assert 29 < rate_limiter._try_acquire(10) <= 30
+
+def test_token_budget_limits_requests(tmp_path):
+    rate_limiter = SharedRateLimiter(rpm=100, tpm=1000, api_key="key", state_dir=tmp_path)
+
+    assert rate_limiter._try_acquire(900) == 0
+    # 400 tokens are missing, which take 24 seconds at 1000 TPM
+    assert 23 < rate_limiter._try_acquire(500) <= 24
+
+def test_processes_with_the_same_key_share_the_budget(tmp_path):
+    first = SharedRateLimiter(rpm=1, tpm=1000, api_key="key", state_dir=tmp_path)
+    second = SharedRateLimiter(rpm=1, tpm=1000, api_key="key", state_dir=tmp_path)
+    other_key = SharedRateLimiter(rpm=1, tpm=1000, api_key="other", state_dir=tmp_path)
+
+    assert first._try_acquire(10) == 0
+    assert second._try_acquire(10) > 0
+    assert other_key._try_acquire(10) == 0
+
+def test_corrupt_state_starts_with_a_full_bucket(tmp_path):
+    rate_limiter = SharedRateLimiter(rpm=1, tpm=1000, api_key="key", state_dir=tmp_path)
+    with open(rate_limiter.state_path, "w", encoding="utf-8") as f:
+        f.write("{")
+
+    assert rate_limiter._try_acquire(10) == 0
+
+@pytest.mark.parametrize("rpm, tpm", [("", "1000"), ("60", "many"), ("0", "1000"), ("60", "-5")])
+def test_from_env_ignores_missing_or_invalid_limits(monkeypatch, rpm, tpm):
+    monkeypatch.setenv("OPENAI_RPM_LIMIT", rpm)
+    monkeypatch.setenv("OPENAI_TPM_LIMIT", tpm)
+
+    assert SharedRateLimiter.from_env() is None
+
+def test_from_env_reads_the_limits(monkeypatch):
+    monkeypatch.setenv("OPENAI_RPM_LIMIT", "60")
+    monkeypatch.setenv("OPENAI_TPM_LIMIT", "90000")
+
+    rate_limiter = SharedRateLimiter.from_env()
+    assert (rate_limiter.rpm, rate_limiter.tpm) == (60, 90000)
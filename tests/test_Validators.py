@@ -0,0 +1,43 @@
+from Validators import CSVValidator, JSONValidator, RegexValidator, LengthRatioValidator
+
+def test_csv_validator_learns_the_majority_column_count():
+    validator = CSVValidator()
+    validator.learn(["a,b\n1,2", "a,b,c\n1,2,3", "a,b,c\n4,5,6", "a,b\n1,2,3"])
+
+    assert validator.ready
+    assert validator.columns == 3
+    assert validator.validate("", "x,y,z") is None
+    assert validator.validate("", "x,y") == "row 1 has 2 columns instead of 3"
+
+def test_csv_validator_before_learning_checks_rows_against_the_first():
+    validator = CSVValidator()
+
+    assert not validator.ready
+    assert validator.validate("", "a,b\n1,2") is None
+    assert validator.validate("", "a,b\n1,2,3") == "row 2 has 3 columns instead of 2"
+    assert validator.validate("", "") == "empty CSV"
+
+def test_csv_validator_with_columns_does_not_learn():
+    validator = CSVValidator(columns=2, delimiter=";")
+    validator.learn(["a;b;c"] * 3)
+
+    assert validator.columns == 2
+    assert validator.validate("", "a;b") is None
+
+def test_json_validator():
+    assert JSONValidator().validate("", '{"a": 1}') is None
+    assert JSONValidator().validate("", "{a: 1}").startswith("invalid JSON")
+
+def test_regex_validator_matches_the_whole_response():
+    validator = RegexValidator(r"\d+")
+
+    assert validator.validate("", "123") is None
+    assert validator.validate("", "123 apples") is not None
+
+def test_length_ratio_validator():
+    validator = LengthRatioValidator(min_ratio=0.5, max_ratio=2)
+
+    assert validator.validate("abcd", "ab") is None
+    assert validator.validate("abcd", "a") == "length ratio 0.25 is below 0.5"
+    assert validator.validate("abcd", "abcdefghi") == "length ratio 2.25 is above 2"
+    assert validator.validate("", "anything") is None